@@ -22,7 +22,7 @@
 from datetime import datetime
 from enum import unique
 from pathlib import PurePath
-from typing import List
+from typing import List, Optional
 
 from partisan.irods import AVU, DataObject, RodsItem
 from partisan.metadata import AsValueEnum, DublinCore
@@ -101,7 +101,7 @@ class CompressSuffix(AsValueEnum):
 
 
 # Checksums are not metadata in the sense of iRODS AVUs, but are nevertheless metadata
-def has_complete_checksums(obj: DataObject) -> bool:
+def has_complete_checksums(obj: DataObject, replicas: Optional[list] = None) -> bool:
     """Return True if the data object has all required checksums.
 
     This is defined as having complete checksum coverage i.e. that every valid
@@ -110,49 +110,37 @@ def has_complete_checksums(obj: DataObject) -> bool:
 
     Args:
         obj: The data object to check.
+        replicas: The replicas of the data object, if the caller has already fetched
+            them. Optional, fetched from iRODS if not supplied.
 
     Returns:
         True if there is full checksum coverage, or False otherwise.
     """
+    if replicas is None:
+        replicas = obj.replicas()
 
-    if len(obj.replicas()) == 0:
-        raise ValueError(f"The replica list of {obj} is empty")
+    return _has_complete_checksums(obj, replicas)
 
-    for r in obj.replicas():
-        if r.valid and r.checksum is None:
-            log.debug("Valid replica has no checksum", path=obj, number=r.number)
-            return False
 
-    return True
-
-
-def has_matching_checksums(obj: DataObject) -> bool:
+def has_matching_checksums(obj: DataObject, replicas: Optional[list] = None) -> bool:
     """Return True if the data object has the same checksum for every replica.
 
     If the data object does not have complete checksums, this function returns False.
 
     Args:
         obj: The data object to check.
+        replicas: The replicas of the data object, if the caller has already fetched
+            them. Optional, fetched from iRODS if not supplied.
 
     Returns:
         True if all the replicas share the same checksum, or False otherwise.
     """
-    if not has_complete_checksums(obj):
-        return False
-
-    checksum = obj.checksum()
-    for r in obj.replicas():
-        if r.valid and r.checksum != checksum:
-            log.debug(
-                "Valid replica has non-matching checksum",
-                path=obj,
-                number=r.number,
-                expected=checksum,
-                observed=r.checksum,
-            )
-            return False
+    if replicas is None:
+        replicas = obj.replicas()
 
-    return True
+    return _has_complete_checksums(obj, replicas) and _has_matching_checksums(
+        obj, replicas, obj.checksum()
+    )
 
 
 def has_matching_checksum_metadata(obj: DataObject) -> bool:
@@ -175,9 +163,8 @@ def has_matching_checksum_metadata(obj: DataObject) -> bool:
     # It's possible, technically, for there to be multiple checksum AVUs in an
     # object's metadata because iRODS is permissive on this. If we find more than
     # one, we raise an exception.
-    checksum_meta = [
-        avu for avu in obj.metadata() if avu.attribute == DataFile.MD5.value
-    ]
+    md5 = DataFile.MD5.value
+    checksum_meta = [avu for avu in obj.metadata() if avu.attribute == md5]
     if len(checksum_meta) > 1:
         checksums = [avu.value for avu in checksum_meta]
         raise ChecksumError(
@@ -187,13 +174,20 @@ def has_matching_checksum_metadata(obj: DataObject) -> bool:
             observed=checksums,
         )
 
-    if not has_matching_checksums(obj):
+    # The metadata, replicas and checksum are each fetched from iRODS only once and
+    # then shared by the tests below
+    replicas = obj.replicas()
+    if not _has_complete_checksums(obj, replicas):
         return False
 
-    if not has_checksum_metadata(obj):
+    checksum = obj.checksum()
+    if not _has_matching_checksums(obj, replicas, checksum):
         return False
 
-    return AVU(DataFile.MD5, obj.checksum()) in checksum_meta
+    if not checksum_meta:
+        return False
+
+    return AVU(DataFile.MD5, checksum) in checksum_meta
 
 
 def ensure_matching_checksum_metadata(obj: DataObject) -> bool:
@@ -250,9 +244,8 @@ def ensure_matching_checksum_metadata(obj: DataObject) -> bool:
 
     expected_avu = AVU(DataFile.MD5, obj.checksum())
     if expected_avu not in obj.metadata():
-        observed_avus = [
-            avu for avu in obj.metadata() if avu.attribute == DataFile.MD5.value
-        ]
+        md5 = DataFile.MD5.value
+        observed_avus = [avu for avu in obj.metadata() if avu.attribute == md5]
         raise ChecksumError(
             "Existing checksum metadata did not match the iRODS checksum",
             path=obj,
@@ -334,6 +327,50 @@ def has_trimmable_replicas(obj: DataObject, num_replicas=2) -> bool:
     return valid or invalid
 
 
+def classify_replicas(
+    obj: DataObject, num_replicas=2, replicas: Optional[list] = None
+) -> (bool, bool, List[DataObject], List[DataObject]):
+    """Return a tuple describing the state of the replicas of a data object.
+
+    The result is equivalent to calling has_complete_replicas, has_trimmable_replicas
+    and trimmable_replicas, but the replicas are fetched from iRODS only once.
+
+    Args:
+        obj: The data object to check.
+        num_replicas: The expected number of valid replicas. Defaults to 2.
+        replicas: The replicas of the data object, if the caller has already fetched
+            them. Optional, fetched from iRODS if not supplied.
+
+    Returns:
+        A tuple of: True if there are complete replicas, True if there are any
+        replicas to trim, and the lists of trimmable valid and invalid replicas.
+    """
+    if num_replicas < 1:
+        raise ValueError(
+            f"The num_replicas argument may not be less than 1: {num_replicas}"
+        )
+
+    if replicas is None:
+        replicas = obj.replicas()
+
+    valid = []
+    invalid = []
+    for r in replicas:
+        if r.valid:
+            valid.append(r)
+        else:
+            invalid.append(r)
+
+    complete = (
+        len(valid) >= num_replicas
+        and _has_complete_checksums(obj, replicas)
+        and _has_matching_checksums(obj, replicas, obj.checksum())
+    )
+    trim_valid = valid[num_replicas:]
+
+    return complete, bool(trim_valid or invalid), trim_valid, invalid
+
+
 def requires_creation_metadata(obj: DataObject) -> bool:
     """Return True if the data object should have these metadata.
 
@@ -424,7 +461,8 @@ def has_modification_metadata(obj: DataObject) -> bool:
     Returns:
         True if the metadata are present, or False otherwise.
     """
-    return any(avu.attribute == DublinCore.MODIFIED.value for avu in obj.metadata())
+    modified = DublinCore.MODIFIED.value
+    return any(avu.attribute == modified for avu in obj.metadata())
 
 
 def make_modification_metadata(modified: datetime) -> list[AVU]:
@@ -468,7 +506,8 @@ def has_checksum_metadata(obj: DataObject) -> bool:
     Returns:
         True if the metadata are present, or False otherwise.
     """
-    return any(avu.attribute == DataFile.MD5.value for avu in obj.metadata())
+    md5 = DataFile.MD5.value
+    return any(avu.attribute == md5 for avu in obj.metadata())
 
 
 def make_checksum_metadata(checksum: str) -> list[AVU]:
@@ -526,7 +565,8 @@ def has_type_metadata(obj: DataObject) -> bool:
     Returns:
         True if the metadata are present, or False otherwise.
     """
-    return any(avu.attribute == DataFile.TYPE.value for avu in obj.metadata())
+    data_type = DataFile.TYPE.value
+    return any(avu.attribute == data_type for avu in obj.metadata())
 
 
 def make_type_metadata(obj: DataObject) -> list[AVU]:
@@ -646,6 +686,54 @@ def avu_if_value(attribute, value):
         return AVU(attribute, value)
 
 
+def _has_complete_checksums(obj: DataObject, replicas: list) -> bool:
+    """Return True if every valid replica in a list of the data object's replicas has a
+    checksum. See has_complete_checksums.
+
+    Args:
+        obj: The data object to check.
+        replicas: The replicas of the data object.
+
+    Returns:
+        True if there is full checksum coverage, or False otherwise.
+    """
+    if len(replicas) == 0:
+        raise ValueError(f"The replica list of {obj} is empty")
+
+    for r in replicas:
+        if r.valid and r.checksum is None:
+            log.debug("Valid replica has no checksum", path=obj, number=r.number)
+            return False
+
+    return True
+
+
+def _has_matching_checksums(obj: DataObject, replicas: list, checksum: str) -> bool:
+    """Return True if every valid replica in a list of the data object's replicas has
+    the expected checksum. See has_matching_checksums.
+
+    Args:
+        obj: The data object to check.
+        replicas: The replicas of the data object.
+        checksum: The expected checksum.
+
+    Returns:
+        True if all the valid replicas have the expected checksum, or False otherwise.
+    """
+    for r in replicas:
+        if r.valid and r.checksum != checksum:
+            log.debug(
+                "Valid replica has non-matching checksum",
+                path=obj,
+                number=r.number,
+                expected=checksum,
+                observed=r.checksum,
+            )
+            return False
+
+    return True
+
+
 def _ensure_avus_present(item: RodsItem, *avus: AVU) -> bool:
     """Ensure that an item in iRODS has the specified metadata.
 
@@ -18,10 +18,13 @@
 # @author Keith James <kdj@sanger.ac.uk>
 
 import io
+import logging
 import os
+import queue
 import shlex
 import subprocess
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from multiprocessing.pool import ThreadPool
 from pathlib import PurePath
 
@@ -33,31 +36,135 @@ from structlog import get_logger
 from npg_irods.exception import ChecksumError
 from npg_irods.metadata.common import (
     DataFile,
+    classify_replicas,
     ensure_common_metadata,
     ensure_matching_checksum_metadata,
     has_checksum_metadata,
     has_common_metadata,
     has_complete_checksums,
-    has_complete_replicas,
     has_creation_metadata,
     has_matching_checksum_metadata,
     has_matching_checksums,
-    has_trimmable_replicas,
     has_type_metadata,
     requires_creation_metadata,
     requires_type_metadata,
-    trimmable_replicas,
 )
 from npg_irods.version import version
 
 log = get_logger(__name__)
 
-print_lock = threading.Lock()
+"""The maximum number of data objects to copy with a single icp command."""
+_ICP_BATCH_SIZE = 100
 
 
-def _print(path, writer):
-    with print_lock:
-        print(path, file=writer)
+def _log_enabled(level: int) -> bool:
+    """Return True if log events at the given level will be emitted by this module's
+    standard library logger.
+
+    Some log events carry values that have to be fetched from iRODS. Checking first
+    allows those queries to be skipped when the event would be discarded anyway. The
+    check does not see structlog's own configuration, so it is only used to decide
+    whether to add those values; the events themselves are always logged.
+    """
+    return logging.getLogger(__name__).isEnabledFor(level)
+
+
+class _PathPrinter:
+    """Prints paths, one per line, to a writer shared by many threads.
+
+    Threads put paths on a queue without taking a lock. A single thread, started on
+    entering the context, drains the queue and writes the paths in batches. Exiting
+    the context waits until all the queued paths have been written.
+    """
+
+    _STOP = object()
+
+    def __init__(self, writer, batch_size=1024):
+        self.writer = writer
+        self.batch_size = batch_size
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._drain, daemon=True)
+        self._error = None
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+        if self._error is not None and exc_type is None:
+            raise self._error
+
+    def print(self, path):
+        self._queue.put(path)
+
+    def _drain(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            done = batch[-1] is self._STOP
+            if done:
+                batch.pop()
+
+            if batch and self._error is None:
+                try:
+                    self.writer.write("".join(f"{path}\n" for path in batch))
+                except Exception as e:
+                    self._error = e
+
+            if done:
+                return
+
+
+def _map_paths(fn, reader, num_threads: int):
+    """Apply a function to each iRODS path read from a file, using a pool of threads.
+
+    This is the common driver for the check and repair utilities. Each worker blocks
+    on baton clients, so the number of requests in flight at any one time is bounded
+    by the smaller of the number of threads and the size of the client pool.
+
+    The file is read lazily and only a few lines per thread are read ahead of the
+    workers, so that work starts immediately and the input need not fit in memory.
+
+    Args:
+        fn: A function accepting the index of the line read and the path on that
+            line, stripped of surrounding whitespace.
+        reader: A file supplying iRODS paths, one per line.
+        num_threads: The number of Python threads to use.
+
+    Returns:
+        A generator of the values returned by the function, in order of completion.
+    """
+    # The reader is consumed sequentially, so advise the kernel to read ahead
+    # aggressively. This is not possible on all platforms or for all types of file
+    # (pipes and in-memory files, for example), in which case it is skipped.
+    try:
+        os.posix_fadvise(reader.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+
+    read_ahead = threading.BoundedSemaphore(num_threads * 4)
+
+    def _read():
+        for i, line in enumerate(reader):
+            read_ahead.acquire()
+            yield i, line.strip()
+
+    def _apply(item):
+        try:
+            return fn(*item)
+        finally:
+            read_ahead.release()
+
+    with ThreadPool(num_threads) as tp:
+        yield from tp.imap_unordered(_apply, _read())
 
 
 def check_checksums(
@@ -87,57 +194,57 @@ def check_checksums(
         and the number of errors (paths with incorrect checksums and/or paths that
         failed to be checked because of an exception).
     """
-    with client_pool(num_clients) as bp:
+    md5 = DataFile.MD5.value
+
+    with client_pool(num_clients) as bp, _PathPrinter(writer) as printer:
 
-        def fn(i: int, path: str) -> bool:
+        def fn(i: int, p: str) -> bool:
             success = False
 
-            p = path.strip()
             try:
                 obj = DataObject(p, pool=bp)
                 if has_matching_checksum_metadata(obj):
                     success = True
                     log.info("Checksums correct", item=i, path=obj)
                     if print_pass:
-                        _print(p, writer)
+                        printer.print(p)
                 else:
-                    checksums = [
-                        avu.value
-                        for avu in obj.metadata()
-                        if avu.attribute == DataFile.MD5.value
-                    ]
-                    checksums.sort()
+                    extra = {}
+                    if _log_enabled(logging.WARNING):
+                        checksums = [
+                            avu.value for avu in obj.metadata() if avu.attribute == md5
+                        ]
+                        checksums.sort()
+                        extra = {"checksum": obj.checksum(), "metadata": checksums}
                     log.warn(
-                        "Checksum metadata do not match",
-                        item=i,
-                        path=obj,
-                        checksum=obj.checksum(),
-                        metadata=checksums,
+                        "Checksum metadata do not match", item=i, path=obj, **extra
                     )
 
                     if print_fail:
-                        _print(p, writer)
+                        printer.print(p)
 
             except RodsError as re:
                 log.error(re.message, item=i, code=re.code)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except ChecksumError as ce:
                 log.error(ce, item=i, expected=ce.expected, observed=ce.observed)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except Exception as e:
                 log.error(e)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
 
             return success
 
-        with ThreadPool(num_threads) as tp:
-            results = tp.starmap(fn, enumerate(reader))
-            num_succeeded = results.count(True)
+        num_processed, num_succeeded = 0, 0
+        for success in _map_paths(fn, reader, num_threads):
+            num_processed += 1
+            if success:
+                num_succeeded += 1
 
-        return len(results), num_succeeded, len(results) - num_succeeded
+        return num_processed, num_succeeded, num_processed - num_succeeded
 
 
 def repair_checksums(
@@ -182,52 +289,60 @@ def repair_checksums(
         repaired and the number of errors (paths with incorrect checksums that could
         not be fixed and/or paths that failed to be fixed because of an exception).
     """
-    with client_pool(num_clients) as bp:
+    with client_pool(num_clients) as bp, _PathPrinter(writer) as printer:
 
-        def fn(i: int, path: str) -> (bool, bool):
+        def fn(i: int, p: str) -> (bool, bool):
             success = False
             repair = False
 
-            p = path.strip()
             try:
                 obj = DataObject(p, pool=bp)
                 if has_matching_checksum_metadata(obj):
                     success = True
                     log.info("Checksum metadata matches", item=i, path=obj)
                 else:
+                    extra = {}
+                    if _log_enabled(logging.INFO):
+                        extra = {
+                            "has_compl_checksums": has_complete_checksums(obj),
+                            "has_match_checksums": has_matching_checksums(obj),
+                            "has_checksum_meta": has_checksum_metadata(obj),
+                        }
                     log.info(
                         "Checksum metadata incomplete; repairing",
                         item=i,
                         path=obj,
-                        has_compl_checksums=has_complete_checksums(obj),
-                        has_match_checksums=has_matching_checksums(obj),
-                        has_checksum_meta=has_checksum_metadata(obj),
+                        **extra,
                     )
                     if ensure_matching_checksum_metadata(obj):
                         success = repair = True
                         if print_repair:
-                            _print(p, writer)
+                            printer.print(p)
 
             except RodsError as re:
                 log.error(re.message, item=i, code=re.code)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except ChecksumError as ce:
                 log.error(ce, item=i, expected=ce.expected, observed=ce.observed)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except Exception as e:
                 log.error(e, item=i)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
 
             return success, repair
 
-        with ThreadPool(num_threads) as tp:
-            results, repaired = zip(*tp.starmap(fn, enumerate(reader)))
-            num_succeeded = results.count(True)
+        num_processed, num_succeeded, num_repaired = 0, 0, 0
+        for success, repair in _map_paths(fn, reader, num_threads):
+            num_processed += 1
+            if success:
+                num_succeeded += 1
+            if repair:
+                num_repaired += 1
 
-        return len(results), repaired.count(True), len(results) - num_succeeded
+        return num_processed, num_repaired, num_processed - num_succeeded
 
 
 def check_replicas(
@@ -265,26 +380,37 @@ def check_replicas(
           and the number of errors (paths with incorrect checksums and/or paths that
           failed to be checked because of an exception).
     """
-    with client_pool(num_clients) as bp:
+    with client_pool(num_clients) as bp, _PathPrinter(writer) as printer:
 
-        def fn(i: int, path: str) -> bool:
+        def fn(i: int, p: str) -> bool:
             success = False
 
-            p = path.strip()
             try:
                 obj = DataObject(p, pool=bp)
-                comp = has_complete_replicas(obj, num_replicas=num_replicas)
-                trim = has_trimmable_replicas(obj, num_replicas=num_replicas)
+                replicas = obj.replicas()
+                comp, trim, _, _ = classify_replicas(
+                    obj, num_replicas=num_replicas, replicas=replicas
+                )
 
                 if comp and not trim:
                     success = True
                     log.info("Replicas are complete", item=i, path=obj)
                     if print_pass:
-                        _print(p, writer)
+                        printer.print(p)
                 else:
-                    nv = len([r for r in obj.replicas() if r.valid])
-                    ni = len([r for r in obj.replicas() if not r.valid])
-
+                    nv = sum(1 for r in replicas if r.valid)
+                    ni = len(replicas) - nv
+
+                    extra = {}
+                    if _log_enabled(logging.WARNING):
+                        extra = {
+                            "has_compl_checksums": has_complete_checksums(
+                                obj, replicas=replicas
+                            ),
+                            "has_match_checksums": has_matching_checksums(
+                                obj, replicas=replicas
+                            ),
+                        }
                     log.warn(
                         "Replicas are incomplete",
                         item=i,
@@ -293,29 +419,30 @@ def check_replicas(
                         num_invalid=ni,
                         has_compl_replicas=comp,
                         has_trim_replicates=trim,
-                        has_compl_checksums=has_complete_checksums(obj),
-                        has_match_checksums=has_matching_checksums(obj),
+                        **extra,
                     )
 
                     if print_fail:
-                        _print(p, writer)
+                        printer.print(p)
 
             except RodsError as re:
                 log.error(re.message, item=i, code=re.code)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except Exception as e:
                 log.error(e, item=i)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
 
             return success
 
-        with ThreadPool(num_threads) as tp:
-            results = tp.starmap(fn, enumerate(reader))
-            num_succeeded = results.count(True)
+        num_processed, num_succeeded = 0, 0
+        for success in _map_paths(fn, reader, num_threads):
+            num_processed += 1
+            if success:
+                num_succeeded += 1
 
-        return len(results), num_succeeded, len(results) - num_succeeded
+        return num_processed, num_succeeded, num_processed - num_succeeded
 
 
 def repair_replicas(
@@ -354,20 +481,20 @@ def repair_replicas(
         repaired and the number of errors (paths with incorrect replicas that could
         not be fixed and/or paths that failed to be fixed because of an exception).
     """
-    with client_pool(num_clients) as bp:
+    with client_pool(num_clients) as bp, _PathPrinter(writer) as printer:
 
-        def fn(i: int, path: str) -> (bool, bool):
+        def fn(i: int, p: str) -> (bool, bool):
             success = False
             repair = False
 
-            p = path.strip()
             try:
                 obj = DataObject(p, pool=bp)
-                comp = has_complete_replicas(obj, num_replicas=num_replicas)
-                trim = has_trimmable_replicas(obj, num_replicas=num_replicas)
+                replicas = obj.replicas()
+                comp, trim, valid, invalid = classify_replicas(
+                    obj, num_replicas=num_replicas, replicas=replicas
+                )
 
                 if trim:
-                    valid, invalid = trimmable_replicas(obj, num_replicas=num_replicas)
                     if valid:
                         nv, ni = obj.trim_replicas(valid=True, invalid=False)
                         log.info(
@@ -389,36 +516,49 @@ def repair_replicas(
 
                     repair = success = True
                     if print_repair:
-                        _print(p, writer)
+                        printer.print(p)
                 else:
                     success = True
+                    extra = {}
+                    if _log_enabled(logging.INFO):
+                        extra = {
+                            "has_compl_checksums": has_complete_checksums(
+                                obj, replicas=replicas
+                            ),
+                            "has_match_checksums": has_matching_checksums(
+                                obj, replicas=replicas
+                            ),
+                            "has_checksum_meta": has_checksum_metadata(obj),
+                        }
                     log.info(
                         "No replicas to trim",
                         item=i,
                         path=obj,
-                        has_compl_checksums=has_complete_checksums(obj),
-                        has_match_checksums=has_matching_checksums(obj),
-                        has_checksum_meta=has_checksum_metadata(obj),
                         has_compl_replicas=comp,
                         has_trim_replicas=trim,
+                        **extra,
                     )
 
             except RodsError as re:
                 log.error(re.message, item=i, code=re.code)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except Exception as e:
                 log.error(e, item=i)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
 
             return success, repair
 
-        with ThreadPool(num_threads) as tp:
-            results, repaired = zip(*tp.starmap(fn, enumerate(reader)))
-            num_succeeded = results.count(True)
+        num_processed, num_succeeded, num_repaired = 0, 0, 0
+        for success, repair in _map_paths(fn, reader, num_threads):
+            num_processed += 1
+            if success:
+                num_succeeded += 1
+            if repair:
+                num_repaired += 1
 
-        return len(results), repaired.count(True), len(results) - num_succeeded
+        return num_processed, num_repaired, num_processed - num_succeeded
 
 
 def check_common_metadata(
@@ -441,51 +581,57 @@ def check_common_metadata(
     Returns:
         True if all checks are done.
     """
-    with client_pool(num_clients) as bp:
+    with client_pool(num_clients) as bp, _PathPrinter(writer) as printer:
 
-        def fn(i: int, path: str):
+        def fn(i: int, p: str):
             success = False
 
-            p = path.strip()
             try:
                 obj = DataObject(p, pool=bp)
                 if has_common_metadata(obj):
                     log.info("Common metadata complete", item=i, path=obj)
                     if print_pass:
-                        _print(p, writer)
+                        printer.print(p)
                 else:
+                    extra = {}
+                    if _log_enabled(logging.WARNING):
+                        extra = {
+                            "has_checksum_meta": has_checksum_metadata(obj),
+                            "has_creation_meta": has_creation_metadata(obj),
+                            "has_type_meta": has_type_metadata(obj),
+                        }
                     log.warn(
                         "Common metadata incomplete",
                         item=i,
                         path=obj,
                         req_checksum_meta=requires_creation_metadata(obj),
-                        has_checksum_meta=has_checksum_metadata(obj),
                         req_creation_meta=requires_creation_metadata(obj),
-                        has_creation_meta=has_creation_metadata(obj),
                         req_type_meta=requires_type_metadata(obj),
-                        has_type_meta=has_type_metadata(obj),
+                        **extra,
                     )
 
                     if print_fail:
-                        _print(p, writer)
+                        printer.print(p)
 
                 success = True
 
             except RodsError as re:
                 log.error(re.message, item=i, code=re.code)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except Exception as e:
                 log.error(e, item=i)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
 
             return success
 
-        with ThreadPool(num_threads) as tp:
-            succeeded = tp.starmap(fn, enumerate(reader))
+        num_failed = 0
+        for success in _map_paths(fn, reader, num_threads):
+            if not success:
+                num_failed += 1
 
-        return all(succeeded)
+        return num_failed == 0
 
 
 def repair_common_metadata(
@@ -523,52 +669,71 @@ def repair_common_metadata(
     Returns:
         True if all repairs were done.
     """
-    with client_pool(num_clients) as bp:
+    with client_pool(num_clients) as bp, _PathPrinter(writer) as printer:
 
-        def fn(i: int, path: str) -> bool:
+        def fn(i: int, p: str) -> bool:
             success = False
 
-            p = path.strip()
             try:
                 obj = DataObject(p, pool=bp)
                 if not has_common_metadata(obj):
+                    extra = {}
+                    if _log_enabled(logging.INFO):
+                        extra = {
+                            "has_checksum": has_checksum_metadata(obj),
+                            "has_creation": has_creation_metadata(obj),
+                            "has_type": has_type_metadata(obj),
+                        }
                     log.info(
                         "Common metadata incomplete; repairing",
                         item=i,
                         path=obj,
                         req_checksum=requires_creation_metadata(obj),
-                        has_checksum=has_checksum_metadata(obj),
                         req_creation=requires_creation_metadata(obj),
-                        has_creation=has_creation_metadata(obj),
                         req_type=requires_type_metadata(obj),
-                        has_type=has_type_metadata(obj),
+                        **extra,
                     )
 
                     if ensure_common_metadata(obj, creator=creator):
                         if print_repair:
-                            _print(p, writer)
+                            printer.print(p)
                     success = True
             except RodsError as re:
                 log.error(re.message, item=i, code=re.code)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
             except Exception as e:
                 log.error(e, item=i)
                 if print_fail:
-                    _print(p, writer)
+                    printer.print(p)
 
             return success
 
-        with ThreadPool(num_threads) as tp:
-            succeeded = tp.starmap(fn, enumerate(reader))
+        num_failed = 0
+        for success in _map_paths(fn, reader, num_threads):
+            if not success:
+                num_failed += 1
 
-        return all(succeeded)
+        return num_failed == 0
 
 
-def copy(src, dest, acl=False, avu=False, exist_ok=False, recurse=False) -> (int, int):
+def copy(
+    src,
+    dest,
+    acl=False,
+    avu=False,
+    exist_ok=False,
+    recurse=False,
+    num_threads=1,
+) -> (int, int):
     """Copy a collection or data object from one location to another, optionally
     including metadata and permissions.
 
+    When recursing, collections are created by the calling thread, while the data
+    objects within them are copied in batches by a pool of threads. If a batch fails,
+    no further collections are created or batches started. Every failed batch is
+    logged, and the first error is raised once the batches already running are done.
+
     Args:
         src: A DataObject, Collection, PurePath or str path to copy from.
         dest: A DataObject, Collection, PurePath or str path to copy to.
@@ -578,6 +743,9 @@ def copy(src, dest, acl=False, avu=False, exist_ok=False, recurse=False) -> (int
             destination. If they exist and are identical to what would be the result of
             copying, do not raise an error.
         recurse: If True, recurse into collections when copying.
+        num_threads: The number of Python threads to use for copying data objects
+            when recursing. Defaults to 1, in which case the batches are copied by
+            the calling thread as they are reached.
 
     Returns:
         A tuple of the number of items (collections and data objects) processed, the
@@ -589,7 +757,38 @@ def copy(src, dest, acl=False, avu=False, exist_ok=False, recurse=False) -> (int
     Raises:
         ChecksumError if checksums are inconsistent.
     """
-    num_processed, num_copied = 0, 0
+    # The executor and its queue slots are only created for a recursive copy of a
+    # collection using more than one thread. Otherwise, there is no executor and each
+    # batch is copied by the calling thread when it is submitted.
+    executor, queue_slots = None, None
+    futures = []
+    errors = []
+
+    def _batch_done(future):
+        queue_slots.release()
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            log.error("Failed to copy a batch of data objects", error=e)
+            errors.append(e)
+
+    def _check_errors():
+        # Stop walking the tree as soon as any batch has failed
+        if errors:
+            raise errors[0]
+
+    def _submit(fn, *args) -> int:
+        if executor is None:
+            return fn(*args)
+
+        queue_slots.acquire()
+        if errors:
+            queue_slots.release()
+            raise errors[0]
+
+        future = executor.submit(fn, *args)
+        future.add_done_callback(_batch_done)
+        futures.append(future)
+        return 0
 
     def _cp_avu_acl(s, d):
         if avu:
@@ -599,7 +798,7 @@ def copy(src, dest, acl=False, avu=False, exist_ok=False, recurse=False) -> (int
             n = d.add_permissions(*s.permissions())
             log.info(f"Added {n} permissions", path=d)
 
-    def _maybe_copy_obj(s: DataObject, d: DataObject) -> int:
+    def _exists_identical(s: DataObject, d: DataObject) -> bool:
         if exist_ok and d.exists():
             if s.checksum() != d.checksum():
                 raise ChecksumError(
@@ -627,12 +826,68 @@ def copy(src, dest, acl=False, avu=False, exist_ok=False, recurse=False) -> (int
                 checksum=d.checksum(),
             )
 
+            return True
+
+        return False
+
+    def _maybe_copy_obj(s: DataObject, d: DataObject) -> int:
+        if _exists_identical(s, d):
             return 0
 
         log.info("Copying data object", src=s, dest=d)
-        _icp(str(s), str(d), verify_checksum=True)
+        _icp(str(s), dest=str(d), verify_checksum=True)
         return 1
 
+    def _copy_obj_retry(s: DataObject, d: DataObject) -> int:
+        # Retry part of a batch that failed. The batch icp may have copied this data
+        # object before it failed, in which case only the AVUs and ACL remain to copy
+        if d.exists() and d.checksum() == s.checksum():
+            _cp_avu_acl(s, d)
+            return 1
+
+        n = _maybe_copy_obj(s, d)
+        _cp_avu_acl(s, d)
+        return n
+
+    def _maybe_copy_objs(objs: list[DataObject], d: Collection) -> int:
+        # Copy a batch of data objects into a collection with a single icp process,
+        # to amortise the cost of starting icp and connecting to iRODS. Data objects
+        # already at the destination are copied one at a time, which reports any error
+        # against the data object concerned.
+        batch, single = [], []
+        for s in objs:
+            obj = DataObject(PurePath(d.path, s.name))
+            if _exists_identical(s, obj):
+                _cp_avu_acl(s, obj)
+            elif not exist_ok and obj.exists():
+                single.append((s, obj))
+            else:
+                batch.append((s, obj))
+
+        num_copied = 0
+        if batch:
+            log.info("Copying data objects", num_objs=len(batch), dest=d)
+            try:
+                _icp(*[str(s) for s, _ in batch], dest=str(d), verify_checksum=True)
+            except RodsError as re:
+                log.warn(
+                    "Failed to copy a batch of data objects; retrying singly",
+                    dest=d,
+                    error=re.message,
+                )
+                for s, obj in batch:
+                    num_copied += _copy_obj_retry(s, obj)
+            else:
+                for s, obj in batch:
+                    _cp_avu_acl(s, obj)
+                num_copied += len(batch)
+
+        for s, obj in single:
+            num_copied += _maybe_copy_obj(s, obj)
+            _cp_avu_acl(s, obj)
+
+        return num_copied
+
     def _maybe_copy_coll(s: Collection, d: Collection) -> int:
         if exist_ok and d.exists():
             log.info(
@@ -644,62 +899,94 @@ def copy(src, dest, acl=False, avu=False, exist_ok=False, recurse=False) -> (int
 
         log.info("Copying collection", src=s, dest=d)
 
-        coll.create(exist_ok=exist_ok)
+        d.create(exist_ok=exist_ok)
         return 1
 
-    if not isinstance(src, RodsItem):
-        src = make_rods_item(src)
-    if not isinstance(dest, RodsItem):
-        dest = make_rods_item(dest)
+    def _copy_coll_into_obj(s: Collection, d: DataObject) -> (int, int):
+        raise ValueError(f"Cannot copy a collection {s} into a data object {d}")
+
+    def _copy_coll_into_coll(s: Collection, d: Collection) -> (int, int):
+        _check_errors()
+
+        coll = Collection(PurePath(d.path, s.path.name))
+        num_processed = 1
+        num_copied = _maybe_copy_coll(s, coll)
+        _cp_avu_acl(s, coll)
+
+        if recurse:
+            objs = []
+            for item in s.contents():
+                if isinstance(item, partisan.irods.DataObject):
+                    objs.append(item)
+                    continue
+
+                np, nc = _copy(item, Collection(coll.path))
+                num_processed += np
+                num_copied += nc
+
+            # When batches are copied by the executor, the data objects are counted
+            # as copied when their batch is done
+            num_processed += len(objs)
+            for i in range(0, len(objs), _ICP_BATCH_SIZE):
+                num_copied += _submit(
+                    _maybe_copy_objs, objs[i : i + _ICP_BATCH_SIZE], coll
+                )
 
-    match (src.rods_type, dest.rods_type):
-        case (partisan.irods.Collection, partisan.irods.DataObject):
+        return num_processed, num_copied
+
+    def _copy_obj_into_obj(s: DataObject, d: DataObject) -> (int, int):
+        num_copied = _maybe_copy_obj(s, d)
+        _cp_avu_acl(s, d)
+        return 1, num_copied
+
+    def _copy_obj_into_coll(s: DataObject, d: Collection) -> (int, int):
+        return _copy_obj_into_obj(s, DataObject(PurePath(d.path, s.name)))
+
+    # Handlers by (source type, destination type), where a destination type of
+    # None means that there is nothing at the destination path yet
+    handlers = {
+        (partisan.irods.Collection, partisan.irods.DataObject): _copy_coll_into_obj,
+        (partisan.irods.Collection, partisan.irods.Collection): _copy_coll_into_coll,
+        (partisan.irods.Collection, None): _copy_coll_into_coll,
+        (partisan.irods.DataObject, partisan.irods.DataObject): _copy_obj_into_obj,
+        (partisan.irods.DataObject, None): _copy_obj_into_obj,
+        (partisan.irods.DataObject, partisan.irods.Collection): _copy_obj_into_coll,
+    }
+
+    def _copy(s, d) -> (int, int):
+        handler = handlers.get((s.rods_type, d.rods_type))
+        if handler is None:
             raise ValueError(
-                f"Cannot copy a collection {src} into a data object {dest}"
+                f"Invalid iRODS path type combination src: {s}: "
+                f"src type: {s.rods_type}, "
+                f"dest: {d}, dest type: {d.rods_type}"
             )
 
-        case (partisan.irods.Collection, partisan.irods.Collection) | (
-            partisan.irods.Collection,
-            None,
-        ):
-            coll = Collection(PurePath(dest.path, src.path.name))
-            num_processed += 1
-            num_copied += _maybe_copy_coll(src, coll)
-            _cp_avu_acl(src, coll)
-
-            if recurse:
-                for item in src.contents():
-                    np, nc = copy(
-                        item,
-                        Collection(coll.path),
-                        avu=avu,
-                        acl=acl,
-                        exist_ok=exist_ok,
-                        recurse=True,
-                    )
-                    num_processed += np
-                    num_copied += nc
-
-        case (partisan.irods.DataObject, partisan.irods.DataObject) | (
-            partisan.irods.DataObject,
-            None,
-        ):
-            num_processed += 1
-            num_copied += _maybe_copy_obj(src, dest)
-            _cp_avu_acl(src, dest)
+        return handler(s, d)
 
-        case (partisan.irods.DataObject, partisan.irods.Collection):
-            obj = DataObject(PurePath(dest.path, src.name))
-            num_processed += 1
-            num_copied += _maybe_copy_obj(src, obj)
-            _cp_avu_acl(src, obj)
+    if not isinstance(src, RodsItem):
+        src = make_rods_item(src)
+    if not isinstance(dest, RodsItem):
+        dest = make_rods_item(dest)
 
-        case _:
-            raise ValueError(
-                f"Invalid iRODS path type combination src: {src}: "
-                f"src type: {src.rods_type}, "
-                f"dest: {dest}, dest type: {dest.rods_type}"
-            )
+    if num_threads == 1 or not (recurse and src.rods_type == partisan.irods.Collection):
+        return _copy(src, dest)
+
+    # Limit the number of batches queued ahead of the threads copying them, so
+    # that the traversal does not run arbitrarily far ahead on a large tree
+    queue_slots = threading.BoundedSemaphore(num_threads * 4)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        try:
+            num_processed, num_copied = _copy(src, dest)
+            for f in as_completed(futures):
+                num_copied += f.result()
+        except Exception:
+            # Batches not yet started are abandoned. The executor waits for those
+            # already running, whose errors are logged as they finish
+            for f in futures:
+                f.cancel()
+            raise
 
     return num_processed, num_copied
 
@@ -714,24 +1001,30 @@ def write_safe_remove_commands(target, writer: io.TextIOBase):
 
     def _log_print(cmd, path):
         quoted_path = shlex.quote(str(path))
-        log.info(f"{cmd} {quoted_path}")
-        print(cmd, quoted_path, file=writer)
+        line = f"{cmd} {quoted_path}"
+        log.info(line)
+        writer.write(line + "\n")
 
     if not isinstance(target, RodsItem):
         target = make_rods_item(target)
     if isinstance(target, partisan.irods.DataObject):
         _log_print("irm", target)
-    else:
-        collections = []
-        for item in target.iter_contents(recurse=True):
+        return
+
+    # Walk the tree depth-first, removing each collection as soon as its contents
+    # have been removed. Only the collections on the current path are held in memory.
+    stack = [(target, target.iter_contents())]
+    while stack:
+        coll, contents = stack[-1]
+        for item in contents:
             if isinstance(item, partisan.irods.DataObject):
                 _log_print("irm", item)
             else:
-                collections.append(item)
-        collections.sort(reverse=True)
-        for coll in collections:
+                stack.append((item, item.iter_contents()))
+                break
+        else:
+            stack.pop()
             _log_print("irmdir", coll)
-        _log_print("irmdir", target)
 
 
 def write_safe_remove_script(path, root, stop_on_error=True, verbose=False):
@@ -749,7 +1042,8 @@ def write_safe_remove_script(path, root, stop_on_error=True, verbose=False):
         stop_on_error: Add "set -e" to the script to stop on the first error.
         verbose: Add "set -x" to the script to echo commands to STDERR as they are run.
     """
-    with open(path, "w", encoding="utf-8") as f:
+    # Use a large buffer because a script for a big tree may contain millions of lines
+    with open(path, "w", encoding="utf-8", buffering=1024 * 1024) as f:
         print(f"#!/bin/bash", file=f)
         print(f"# Generated by npg-irods {version()}", file=f)
 
@@ -762,7 +1056,7 @@ def write_safe_remove_script(path, root, stop_on_error=True, verbose=False):
         os.chmod(path, 0o755)
 
 
-def _icp(src, dest, force=False, verify_checksum=True):
+def _icp(*src, dest, force=False, verify_checksum=True):
     cmd = ["icp"]
 
     if force:
@@ -770,10 +1064,9 @@ def _icp(src, dest, force=False, verify_checksum=True):
     if verify_checksum:
         cmd.append("-K")
 
-    cmd.append(src)
+    cmd.extend(src)
     cmd.append(dest)
     log.debug("Running command", cmd=cmd)
-    log.info("Copying data object", src=src, dest=dest, force=force)
 
     completed = subprocess.run(cmd, capture_output=True)
     if completed.returncode == 0:
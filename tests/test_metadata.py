@@ -19,7 +19,7 @@
 
 import datetime
 import re
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import pytest
 from partisan.irods import AVU, DataObject, Replica
@@ -31,6 +31,7 @@ from npg_irods.metadata.common import (
     CompressSuffix,
     DataFile,
     RECOGNISED_FILE_SUFFIXES,
+    classify_replicas,
     ensure_checksum_metadata,
     ensure_creation_metadata,
     ensure_matching_checksum_metadata,
@@ -144,6 +145,22 @@ class TestChecksums:
             assert has_complete_checksums(obj)
             assert not has_matching_checksums(obj)
 
+    @m.context("When the replicas are supplied")
+    @m.it("Uses them without fetching the replicas from iRODS")
+    def test_has_checksums_supplied_replicas(self):
+        obj = DataObject("/dummy/path.txt")
+        checksum = "aaaaaaaaaa"
+        replicas = [
+            Replica("dummy_resource", "dummy_location", 0, checksum=checksum),
+            Replica("dummy_resource", "dummy_location", 1, checksum="invalid_checksum"),
+        ]
+        fetch = Mock(return_value=replicas)
+
+        with patch.multiple(obj, checksum=lambda: checksum, replicas=fetch):
+            assert has_complete_checksums(obj, replicas=replicas)
+            assert not has_matching_checksums(obj, replicas=replicas)
+            fetch.assert_not_called()
+
     @m.context("When a data object has complete checksums")
     @m.context("When there is a single checksum in the metadata")
     @m.context("When data object checksum matches the metadata checksum")
@@ -294,6 +311,96 @@ class TestChecksums:
                 ensure_matching_checksum_metadata(obj)
 
 
+@m.describe("Replicas")
+class TestReplicas:
+    @m.context("When a data object has the expected number of valid replicas")
+    @m.context("When the valid replica checksums match")
+    @m.it("Returns complete, with nothing to trim")
+    def test_classify_replicas_complete(self):
+        obj = DataObject("/dummy/path.txt")
+        checksum = "aaaaaaaaaa"
+        replicas = [
+            Replica("dummy_resource", "dummy_location", 0, checksum=checksum),
+            Replica("dummy_resource", "dummy_location", 1, checksum=checksum),
+        ]
+
+        with patch.multiple(obj, checksum=lambda: checksum, replicas=lambda: replicas):
+            assert classify_replicas(obj, num_replicas=2) == (True, False, [], [])
+
+    @m.context("When a data object has more valid replicas than expected")
+    @m.it("Returns complete, with the excess valid replicas to trim")
+    def test_classify_replicas_excess_valid(self):
+        obj = DataObject("/dummy/path.txt")
+        checksum = "aaaaaaaaaa"
+        replicas = [
+            Replica("dummy_resource", "dummy_location", 0, checksum=checksum),
+            Replica("dummy_resource", "dummy_location", 1, checksum=checksum),
+        ]
+
+        with patch.multiple(obj, checksum=lambda: checksum, replicas=lambda: replicas):
+            assert classify_replicas(obj, num_replicas=1) == (
+                True,
+                True,
+                [replicas[1]],
+                [],
+            )
+
+    @m.context("When a data object has fewer valid replicas than expected")
+    @m.context("When the other replicas are invalid")
+    @m.it("Returns incomplete, with the invalid replicas to trim")
+    def test_classify_replicas_invalid(self):
+        obj = DataObject("/dummy/path.txt")
+        checksum = "aaaaaaaaaa"
+        replicas = [
+            Replica("dummy_resource", "dummy_location", 0, checksum=checksum),
+            Replica("dummy_resource", "dummy_location", 1, checksum=None, valid=False),
+        ]
+
+        with patch.multiple(obj, checksum=lambda: checksum, replicas=lambda: replicas):
+            assert classify_replicas(obj, num_replicas=2) == (
+                False,
+                True,
+                [],
+                [replicas[1]],
+            )
+
+    @m.context("When the replicas are not supplied")
+    @m.it("Fetches them from iRODS once")
+    def test_classify_replicas_fetch_once(self):
+        obj = DataObject("/dummy/path.txt")
+        checksum = "aaaaaaaaaa"
+        replicas = Mock(
+            return_value=[
+                Replica("dummy_resource", "dummy_location", 0, checksum=checksum),
+                Replica("dummy_resource", "dummy_location", 1, checksum=checksum),
+            ]
+        )
+
+        with patch.multiple(obj, checksum=lambda: checksum, replicas=replicas):
+            assert classify_replicas(obj, num_replicas=2) == (True, False, [], [])
+            replicas.assert_called_once()
+
+    @m.context("When the replicas are supplied")
+    @m.it("Does not fetch them from iRODS")
+    def test_classify_replicas_supplied(self):
+        obj = DataObject("/dummy/path.txt")
+        checksum = "aaaaaaaaaa"
+        replicas = [
+            Replica("dummy_resource", "dummy_location", 0, checksum=checksum),
+            Replica("dummy_resource", "dummy_location", 1, checksum=None, valid=False),
+        ]
+        fetch = Mock(return_value=replicas)
+
+        with patch.multiple(obj, checksum=lambda: checksum, replicas=fetch):
+            assert classify_replicas(obj, num_replicas=2, replicas=replicas) == (
+                False,
+                True,
+                [],
+                [replicas[1]],
+            )
+            fetch.assert_not_called()
+
+
 @m.describe("Type metadata")
 class TestTypeMetadata:
     @m.context("When a data object requires type metadata")
@@ -17,20 +17,28 @@
 #
 # @author Keith James <kdj@sanger.ac.uk>
 
+import logging
 import re
 import subprocess
 from io import StringIO
+from multiprocessing.pool import ThreadPool
 from pathlib import Path, PurePath
+from unittest.mock import patch
 
 import partisan.irods
 import pytest
 from partisan.exception import RodsError
+from partisan.icommands import iput
 from partisan.irods import AC, AVU, Collection, DataObject, Permission
 from pytest import mark as m
 
+import npg_irods.utilities
 from conftest import set_replicate_invalid
+from npg_irods.exception import ChecksumError
 from npg_irods.metadata.common import ensure_common_metadata, has_trimmable_replicas
 from npg_irods.utilities import (
+    _map_paths,
+    _PathPrinter,
     check_checksums,
     check_replicas,
     copy,
@@ -194,6 +202,29 @@ class TestReplicaUtilities:
                 failed_paths = writer.getvalue().split()
                 assert failed_paths == obj_paths
 
+    @m.context("When data object replicas are checked")
+    @m.context("When none of the data objects have conforming replicas")
+    @m.it("Fetches the replicas of each data object once")
+    def test_check_replicas_fetch_once(self, annotated_tree, caplog):
+        obj_paths = collect_obj_paths(Collection(annotated_tree))
+        expected_num_replicas = 999  # Cause failure by expecting an impossible number
+
+        # Log at INFO so that the replica details are logged too
+        with caplog.at_level(logging.INFO):
+            with patch.object(
+                DataObject, "replicas", autospec=True, side_effect=DataObject.replicas
+            ) as replicas:
+                with StringIO("\n".join(obj_paths)) as reader:
+                    with StringIO() as writer:
+                        num_processed, num_passed, num_errors = check_replicas(
+                            reader, writer, num_replicas=expected_num_replicas
+                        )
+                        assert num_processed == len(obj_paths)
+                        assert num_passed == 0
+                        assert num_errors == len(obj_paths)
+
+                assert replicas.call_count == len(obj_paths)
+
     @m.context("When data object replicas are repaired")
     @m.context("When all of the data objects have conforming replicas")
     @m.it("Counts repairs correctly")
@@ -253,6 +284,28 @@ class TestReplicaUtilities:
                 repaired_paths = writer.getvalue().split()
                 assert repaired_paths == obj_paths
 
+    @m.context("When data object replicas are repaired")
+    @m.context("When there are no replicas to trim")
+    @m.it("Fetches the replicas of each data object once")
+    def test_repair_replicas_fetch_once(self, annotated_tree, caplog):
+        obj_paths = collect_obj_paths(Collection(annotated_tree))
+
+        # Log at INFO so that the replica details are logged too
+        with caplog.at_level(logging.INFO):
+            with patch.object(
+                DataObject, "replicas", autospec=True, side_effect=DataObject.replicas
+            ) as replicas:
+                with StringIO("\n".join(obj_paths)) as reader:
+                    with StringIO() as writer:
+                        num_processed, num_repaired, num_errors = repair_replicas(
+                            reader, writer, num_replicas=2
+                        )
+                        assert num_processed == len(obj_paths)
+                        assert num_repaired == 0
+                        assert num_errors == 0
+
+                assert replicas.call_count == len(obj_paths)
+
 
 @m.describe("Copy utilities")
 class TestCopyUtilities:
@@ -361,6 +414,24 @@ class TestCopyUtilities:
         assert num_processed == len(expected)
         assert num_copied == len(expected)
 
+    @m.context("When a tree is copied using multiple threads")
+    @m.it("Copies all collections and objects")
+    def test_copy_recurse_threads(self, annotated_tree, simple_collection):
+        src = Collection(annotated_tree)
+        dest = Collection(simple_collection)
+
+        num_processed, num_copied = copy(src, dest, recurse=True, num_threads=4)
+
+        expected = [
+            re.sub(r"annotated_tree", "simple_collection", str(x))
+            for x in [src, *src.contents(recurse=True)]
+        ]
+
+        observed = [str(x) for x in dest.contents(recurse=True)]
+        assert sorted(observed) == sorted(expected)
+        assert num_processed == len(expected)
+        assert num_copied == len(expected)
+
     @m.context("When a tree with annotation is copied")
     @m.it("Copies annotation on collections and data objects")
     def test_copy_annotation_recurse(self, annotated_tree, simple_collection):
@@ -389,6 +460,48 @@ class TestCopyUtilities:
                 in item.permissions()
             )
 
+    @m.context("When a tree is copied")
+    @m.context("When a data object in a batch already exists at the destination")
+    @m.it("Raises an exception, after annotating the data objects already copied")
+    def test_copy_recurse_batch_error(self, annotated_tree, simple_collection):
+        src = Collection(annotated_tree)
+        dest = Collection(simple_collection)
+        dest_tree = PurePath(dest.path, "tree")
+        real_icp = npg_irods.utilities._icp
+
+        def _icp(*src_paths, dest, **kwargs):
+            # Put a different data object in the way of the batch for the tree root,
+            # after the existence checks have been made
+            if len(src_paths) > 1 and PurePath(dest) == dest_tree:
+                iput("./tests/data/simple/data_object/lorem.txt", dest_tree / "y.txt")
+            return real_icp(*src_paths, dest=dest, **kwargs)
+
+        with patch("npg_irods.utilities._icp", side_effect=_icp):
+            with pytest.raises(RodsError, match="OVERWRITE_WITHOUT_FORCE_FLAG"):
+                copy(src, dest, avu=True, recurse=True)
+
+        obj = DataObject(dest_tree / "x.txt")
+        assert obj.exists()
+        assert obj.metadata() == [AVU("path", str(PurePath(src.path, "x.txt")))]
+
+    @m.context("When a tree is copied")
+    @m.context("When a data object in an early collection has a checksum conflict")
+    @m.it("Raises an exception, without creating any later collections")
+    def test_copy_recurse_stops_on_error(self, annotated_tree, simple_collection):
+        src = Collection(annotated_tree)
+        dest = Collection(simple_collection)
+        dest_tree = PurePath(dest.path, "tree")
+
+        # The first collection whose data objects are copied is tree/a/m
+        Collection(dest_tree / "a" / "m").create(parents=True)
+        iput("./tests/data/simple/data_object/lorem.txt", dest_tree / "a/m/w.txt")
+
+        with pytest.raises(ChecksumError):
+            copy(src, dest, exist_ok=True, recurse=True)
+
+        for p in ["a/n", "a/o", "b", "c"]:
+            assert not Collection(dest_tree / p).exists()
+
 
 @m.describe("Safe remove utilities")
 class TestSafeRemoveUtilities:
@@ -400,29 +513,29 @@ class TestSafeRemoveUtilities:
 
             expected = [
                 ("irm", "w.txt"),
+                ("irmdir", "m"),
                 ("irm", "x.txt"),
+                ("irmdir", "n"),
                 ("irm", "y.txt"),
+                ("irmdir", "o"),
                 ("irm", "h.txt"),
                 ("irm", "i.txt"),
                 ("irm", "j.txt"),
+                ("irmdir", "a"),  # a contains m, n & o
                 ("irm", "w.txt"),
+                ("irmdir", "p"),
                 ("irm", "x.txt"),
+                ("irmdir", "q"),
                 ("irm", "z.txt"),
+                ("irmdir", "r"),
+                ("irmdir", "b"),  # b contains p, q & r
+                ("irmdir", "s"),
+                ("irmdir", "t"),
+                ("irmdir", "u"),
+                ("irmdir", "c"),  # c contains s, t & u
                 ("irm", "x.txt"),
                 ("irm", "y.txt"),
                 ("irm", "z.txt"),
-                ("irmdir", "u"),
-                ("irmdir", "t"),
-                ("irmdir", "s"),
-                ("irmdir", "c"),  # c contains t, u & s
-                ("irmdir", "r"),
-                ("irmdir", "q"),
-                ("irmdir", "p"),
-                ("irmdir", "b"),  # b contains p, q & r
-                ("irmdir", "o"),
-                ("irmdir", "n"),
-                ("irmdir", "m"),
-                ("irmdir", "a"),  # a contains m, n & o
                 ("irmdir", "tree"),  # The root
             ]
             observed = []
@@ -451,14 +564,14 @@ class TestSafeRemoveUtilities:
                 ("irm", "x.txt"),
                 ("irm", "y y.txt"),
                 ("irm", 'z".txt'),
+                ("irmdir", "a a"),
                 ("irm", "x.txt"),
                 ("irm", "y y.txt"),
                 ("irm", 'z".txt'),
+                ("irmdir", 'b"b'),
                 ("irm", "x.txt"),
                 ("irm", "y y.txt"),
                 ("irm", 'z".txt'),
-                ("irmdir", 'b"b'),
-                ("irmdir", "a a"),
                 ("irmdir", "special"),
             ]
             observed = []
@@ -479,3 +592,40 @@ class TestSafeRemoveUtilities:
         subprocess.run([script.as_posix()], check=True)
 
         assert not Collection(special_paths).exists()
+
+
+@m.describe("Path driver utilities")
+class TestPathDriverUtilities:
+    @m.context("When paths are printed by many threads")
+    @m.it("Writes each path exactly once")
+    def test_path_printer_threads(self):
+        paths = [f"/testZone/home/irods/test/{i}.txt" for i in range(10_000)]
+
+        with StringIO() as writer:
+            with _PathPrinter(writer, batch_size=64) as printer:
+                with ThreadPool(8) as tp:
+                    tp.map(printer.print, paths)
+
+            printed = writer.getvalue().splitlines()
+            assert len(printed) == len(paths)
+            assert sorted(printed) == sorted(paths)
+
+    @m.context("When the writer raises an exception")
+    @m.it("Raises the exception on exiting the context")
+    def test_path_printer_error(self):
+        class FailingWriter(StringIO):
+            def write(self, s):
+                raise OSError("Dummy write failure")
+
+        with FailingWriter() as writer:
+            with pytest.raises(OSError, match="Dummy write failure"):
+                with _PathPrinter(writer) as printer:
+                    printer.print("/testZone/home/irods/test/x.txt")
+
+    @m.context("When paths are mapped using one thread")
+    @m.it("Preserves the input order and strips whitespace")
+    def test_map_paths_ordered(self):
+        with StringIO("  /a/x.txt\n/a/y.txt  \n\t/a/z.txt\n") as reader:
+            observed = list(_map_paths(lambda i, p: (i, p), reader, 1))
+
+        assert observed == [(0, "/a/x.txt"), (1, "/a/y.txt"), (2, "/a/z.txt")]